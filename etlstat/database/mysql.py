@@ -15,12 +15,17 @@ This module manages MySQL primitives.
 
 """
 
+import errno
 import os
 import logging
+import shutil
+import tempfile
+import threading
 import sqlparse
-from sqlalchemy import create_engine, text, select, func, MetaData, Table
+from sqlalchemy import create_engine, text, select, func, Table
 from sqlalchemy.exc import DatabaseError
 import pandas as pd
+from etlstat.database.utils import fetch_frame, is_ddl, reflect_table
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
@@ -54,8 +59,15 @@ class MySQL:
         self.conn_string = f'''mysql+mysqlconnector://{conn_params[0]}:''' + \
             f'''{conn_params[1]}@{conn_params[2]}:''' + \
             f'''{str(conn_params[3])}/{conn_params[4]}'''
-        self.engine = create_engine(self.conn_string)
+        # keep a warm pool of connections, checking them before use since
+        # MySQL closes idle connections after wait_timeout
+        self.engine = create_engine(self.conn_string,
+                                    pool_size=10,
+                                    max_overflow=20,
+                                    pool_pre_ping=True,
+                                    pool_recycle=1800)
         self.database = conn_params[4]
+        self._tables = {}  # reflected tables by (schema, table name)
 
     def get_table(self, table_name, schema=None):
         """
@@ -73,9 +85,7 @@ class MySQL:
         """
         if not schema:
             schema = self.database
-        meta = MetaData(bind=self.engine, schema=schema)
-        return Table(table_name, meta, autoload=True,
-                     autoload_with=self.engine)
+        return reflect_table(self._tables, self.engine, table_name, schema)
 
     def execute(self, sql, **kwargs):
         """
@@ -96,12 +106,14 @@ class MySQL:
         trans = connection.begin()
         try:
             for statement in statements:
+                if is_ddl(statement):
+                    # DDL may change the definition of cached tables
+                    self._tables.clear()
                 result_set = pd.DataFrame()
                 result = connection.execute(
                     text(statement.strip(';')), **kwargs)
                 if result.returns_rows:
-                    result_set = pd.DataFrame(result.fetchall())
-                    result_set.columns = result.keys()
+                    result_set = fetch_frame(result)
                     LOGGER.info('Number of returned rows: %s',
                                 str(len(result_set.index)))
                 results.append(result_set)
@@ -130,17 +142,21 @@ class MySQL:
             schema = self.database
         db_table = self.get_table(table_name, schema)
         db_table.drop(self.engine, checkfirst=True)
+        self._tables.pop((schema, table_name), None)
         LOGGER.info('Table %s.%s successfully dropped.', schema, table_name)
 
         # Placeholders can only represent VALUES. You cannot use them for
         # sql keywords/identifiers.
 
     def insert(self, data_table, if_exists='fail',
-               columns=['*'], schema=None, rm_tmp=True):
+               columns=['*'], schema=None, rm_tmp=True, method='load',
+               chunksize=10000, connection=None):
         r"""
         Insert a dataframe into a table.
 
-        Converts the dataframe to CSV format and bulk loads it.
+        Converts the dataframe to CSV format and bulk loads it. Servers
+        which do not allow LOAD DATA LOCAL INFILE can be loaded with
+        multi-row INSERT statements instead.
 
         Args:
           data_table(Dataframe): dataframe with the data to load.
@@ -155,58 +171,169 @@ class MySQL:
           schema (string): name of the database that contains the
                            destination table.
           rm_tmp (bool): remove or not the temporary csv file. Defaults to
-                         True.
+                         True. If True and the platform supports named
+                         pipes, the CSV data is streamed to the server
+                         instead of being written to disk.
+          method (string): {'load', 'multi'}, default 'load'. 'load' bulk
+                           loads a CSV file with LOAD DATA LOCAL INFILE;
+                           'multi' sends INSERT statements with multiple
+                           VALUES rows (see `pandas.to_sql()`).
+          chunksize (int): number of rows per INSERT statement when method
+                           is 'multi'. Defaults to 10000.
+          connection (Connection): optional sqlalchemy connection to run the
+                                   load on. Defaults to None (a pooled
+                                   connection is checked out and released
+                                   by the method).
         Returns:
           db_table(Table): sqlalchemy table mapping the table with the inserted
                            records.
 
         """
-        tmpfile = 'tmp.csv'  # filename for temporary file to load from
-        sep = ';'  # separator for temp file
-        quotechar = '"'  # Character used to quote fields
-        line_terminated_by = '\n'  # termination character for file lines
+        if not isinstance(data_table, pd.DataFrame):
+            raise TypeError("data_table must be a DataFrame.")
+        if method not in ('load', 'multi'):
+            raise ValueError("method must be 'load' or 'multi'.")
 
+        # identifiers cannot be bound as parameters, so they are quoted
+        # when they are reserved words or contain special characters
+        preparer = self.engine.dialect.identifier_preparer
         if columns == ['*']:
-            columns = ', '.join(data_table.columns)
-        else:
-            columns = ', '.join(columns)
+            columns = list(data_table.columns)
+        column_list = ', '.join(preparer.quote(column) for column in columns)
 
         if not schema:
             schema = self.database
-
-        connection = self.engine.connect()
+        target = f'''{preparer.quote_schema(schema)}.''' + \
+            f'''{preparer.quote(data_table.name)}'''
+
+        own_connection = connection is None
+        if own_connection:
+            connection = self.engine.connect()
+        if if_exists == 'replace':
+            # the table is recreated in the connection database, which is
+            # where get_table looks it up below
+            self._tables.pop((self.database, data_table.name), None)
         db_table = Table()
-        if isinstance(data_table, pd.DataFrame):
-            data_table[:0].to_sql(data_table.name, self.engine,
-                                  if_exists=if_exists, index=False)
-        else:
-            raise TypeError("data_table must be a DataFrame.")
         try:
-            LOGGER.info('creating %s ok', tmpfile)
-            data_table.to_csv(tmpfile, na_rep='\\N', header=False,
-                              index=False, sep=sep, quotechar=quotechar)
-            LOGGER.info('loading %s ok', tmpfile)
-            sql_load = f'''LOAD DATA LOCAL INFILE '{tmpfile}' INTO TABLE
-                           {schema}.{data_table.name}
-                           FIELDS TERMINATED BY '{sep}'
-                           OPTIONALLY ENCLOSED BY '{quotechar}'
-                           LINES TERMINATED BY '{line_terminated_by}'
-                           ({columns});'''
-            connection.execute(sql_load)
-            if rm_tmp:
-                os.remove(tmpfile)
+            data_table[:0].to_sql(data_table.name, connection,
+                                  if_exists=if_exists, index=False)
+            if method == 'multi':
+                data_table[columns].to_sql(data_table.name, connection,
+                                           schema=schema, if_exists='append',
+                                           index=False, method='multi',
+                                           chunksize=chunksize)
+                row_count = len(data_table.index)
+            else:
+                row_count = self._load_data(data_table, target, column_list,
+                                            connection, rm_tmp=rm_tmp)
             db_table = self.get_table(data_table.name)
-            row_count = connection.engine.scalar(
-                select([func.count('*')]).select_from(db_table))
             LOGGER.info('Number of inserted rows: %s', str(row_count))
         except Exception as exception:
             LOGGER.error(exception)
             raise
         finally:
-            connection.close()
+            if own_connection:
+                connection.close()
         return db_table
 
-    def upsert(self, tmp_data, table_name, sql, if_exists='fail',
+    @staticmethod
+    def _load_data(data_table, target, column_list, connection, rm_tmp=True):
+        r"""
+        Bulk load a dataframe with LOAD DATA LOCAL INFILE.
+
+        The dataframe is converted to CSV in a temporary directory of its
+        own. When the file is not kept and named pipes are available, the
+        CSV is written by a separate thread into a FIFO which the server
+        reads from, so data is never materialized on disk. The load is run
+        in a transaction which is rolled back if the CSV conversion fails.
+
+        Args:
+          data_table(Dataframe): dataframe with the data to load.
+          target(string): quoted name of the destination table.
+          column_list(string): quoted names of the columns to load,
+                               separated by commas.
+          connection (Connection): sqlalchemy connection to run the load on.
+          rm_tmp (bool): remove or not the temporary csv file. Defaults to
+                         True.
+        Returns:
+          row_count(int): number of loaded rows.
+
+        """
+        sep = ';'  # separator for temp file
+        quotechar = '"'  # Character used to quote fields
+        line_terminated_by = '\n'  # termination character for file lines
+
+        tmp_dir = tempfile.mkdtemp()
+        tmpfile = os.path.join(tmp_dir, f'{data_table.name}.csv')
+        infile = tmpfile.replace(os.sep, '/')
+        sql_load = f'''LOAD DATA LOCAL INFILE '{infile}' INTO TABLE
+                       {target}
+                       FIELDS TERMINATED BY '{sep}'
+                       OPTIONALLY ENCLOSED BY '{quotechar}'
+                       LINES TERMINATED BY '{line_terminated_by}'
+                       ({column_list});'''
+        errors = []
+        released = threading.Event()
+
+        def stream_csv():
+            # the pipe is opened without blocking, so the writer can give
+            # up if the server never opens it (e.g. the statement failed)
+            pipe = None
+            while pipe is None and not released.is_set():
+                try:
+                    pipe = os.open(tmpfile, os.O_WRONLY | os.O_NONBLOCK)
+                except OSError as os_error:
+                    if os_error.errno != errno.ENXIO:  # ENXIO: no reader
+                        errors.append(os_error)
+                        return
+                    released.wait(0.01)
+            if pipe is None:
+                return
+            os.set_blocking(pipe, True)
+            try:
+                with os.fdopen(pipe, 'w', encoding='utf8') as csv_file:
+                    data_table.to_csv(csv_file, na_rep='\\N', header=False,
+                                      index=False, sep=sep,
+                                      quotechar=quotechar)
+            except Exception as exception:  # raised by the loading thread
+                errors.append(exception)
+
+        row_count = 0
+        # the server loads whatever it reads until EOF, so a load whose
+        # CSV conversion failed halfway must be rolled back
+        trans = connection.begin()
+        try:
+            if rm_tmp and hasattr(os, 'mkfifo'):
+                os.mkfifo(tmpfile)
+                writer = threading.Thread(target=stream_csv)
+                writer.start()
+                LOGGER.info('streaming %s ok', tmpfile)
+                try:
+                    # LOAD DATA sends the whole file in a single statement,
+                    # so the affected rows of the result are the inserted
+                    # rows.
+                    row_count = connection.execute(sql_load).rowcount
+                finally:
+                    released.set()
+                    writer.join()
+                if errors:
+                    raise errors[0]
+            else:
+                LOGGER.info('creating %s ok', tmpfile)
+                data_table.to_csv(tmpfile, na_rep='\\N', header=False,
+                                  index=False, sep=sep, quotechar=quotechar)
+                LOGGER.info('loading %s ok', tmpfile)
+                row_count = connection.execute(sql_load).rowcount
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+        finally:
+            if rm_tmp:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return row_count
+
+    def upsert(self, tmp_data, table_name, sql=None, if_exists='fail',
                columns=['*'], rm_tmp=True, schema=None):
         r"""
         Update/insert a dataframe into a table.
@@ -214,14 +341,18 @@ class MySQL:
         Converts the dataframe to CSV format, and bulk loads it to a temporary
         table and then executing a raw update or update/insert query from a
         text file which extracts records from the temporary table and loads
-        them into the definitive one.
+        them into the definitive one. If no query is given, a single
+        INSERT ... SELECT ... ON DUPLICATE KEY UPDATE statement is generated
+        from the primary key of the destination table.
 
         Args:
             tmp_data(Dataframe): dataframe with the data to load in a
                                     temporary table.
             table_name(String): name of the table to be
                                 updated/inserted to.
-            sql(string): string with the SQL update/insert query.
+            sql(string): string with the SQL update/insert query. Defaults
+                         to None (generated from the primary key of the
+                         destination table).
             if_exists(string): {‘fail’, ‘replace’, ‘append’}, default ‘fail’.
                                See `pandas.to_sql()` for details. Warning: if
                                replace is chosen, PKs will be deleted and will
@@ -244,13 +375,24 @@ class MySQL:
 
         connection = self.engine.connect()
         try:
-            self.insert(tmp_data, if_exists=if_exists, columns=columns,
-                        rm_tmp=rm_tmp, schema=schema)
-            connection.execute(sql)  # update/insert query
+            # load and update/insert are committed once, as a whole
+            trans = connection.begin()
+            try:
+                self.insert(tmp_data, if_exists=if_exists, columns=columns,
+                            rm_tmp=rm_tmp, schema=schema,
+                            connection=connection)
+                if not sql:
+                    sql = self._upsert_sql(tmp_data, table_name, columns,
+                                           schema)
+                connection.execute(sql)  # update/insert query
+                trans.commit()
+            except DatabaseError:
+                trans.rollback()
+                raise
             if rm_tmp:
                 self.drop(tmp_data.name)  # remove temporary table
             db_table = self.get_table(table_name)
-            row_count = connection.engine.scalar(
+            row_count = connection.scalar(
                 select([func.count('*')]).select_from(db_table)
             )
             LOGGER.info('Number of rows in the updated table: %s',
@@ -261,3 +403,37 @@ class MySQL:
         finally:
             connection.close()
         return db_table
+
+    def _upsert_sql(self, tmp_data, table_name, columns, schema):
+        """
+        Build an update/insert query from a temporary table.
+
+        Args:
+            tmp_data(Dataframe): dataframe loaded in the temporary table.
+            table_name(String): name of the table to be updated/inserted to.
+            columns(list): list of str containing the column names to
+                           update/insert. ['*'] stands for all the columns
+                           of the dataframe.
+            schema (string): name of the database that contains both tables.
+        Returns:
+            sql(string): INSERT ... SELECT ... ON DUPLICATE KEY UPDATE query.
+
+        """
+        quote = self.engine.dialect.identifier_preparer.quote
+        if columns == ['*']:
+            columns = list(tmp_data.columns)
+        db_table = self.get_table(table_name, schema)
+        keys = [column.name for column in db_table.primary_key.columns]
+        # key columns identify the row to update, so they are not assigned
+        set_columns = [column for column in columns if column not in keys]
+        if not set_columns:
+            set_columns = columns
+        column_list = ', '.join(quote(column) for column in columns)
+        assignments = ', '.join(
+            f'{quote(column)} = VALUES({quote(column)})'
+            for column in set_columns)
+        return f'''INSERT INTO {quote(schema)}.{quote(table_name)}
+                   ({column_list})
+                   SELECT {column_list}
+                   FROM {quote(schema)}.{quote(tmp_data.name)}
+                   ON DUPLICATE KEY UPDATE {assignments}'''
@@ -13,21 +13,52 @@ This module manages Oracle primitives.
 """
 
 import csv
+import functools
 import logging
 import os
-import shlex
 import subprocess
 
 import pandas as pd
 
-from sqlalchemy import MetaData, Table, create_engine, text
+from sqlalchemy import create_engine, text
 from sqlalchemy.exc import DatabaseError
+from sqlalchemy.util import LRUCache
 
 import sqlparse
 
+from etlstat.database.utils import fetch_frame, is_ddl, reflect_table
+
+try:
+    import pyarrow
+    from pyarrow import csv as pyarrow_csv
+except ImportError:  # optional dependency: falls back to pandas.to_csv
+    pyarrow = None
+
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
+STATEMENT_CACHE_SIZE = 256  # distinct SQL strings kept prepared
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _prepare(sql):
+    """
+    Split a SQL string into statements ready to be executed.
+
+        The result is cached by SQL string, so repeated calls skip both the
+        sqlparse split and the construction of the text() clauses.
+
+        Args:
+            sql (string): SQL statement(s) separated by semicolons (;)
+        Returns:
+            statements (tuple): pairs of (TextClause, bool), the boolean
+                being True for statements other than SELECT, INSERT,
+                UPDATE or DELETE.
+
+    """
+    return tuple((text(statement.strip(';')), is_ddl(statement))
+                 for statement in sqlparse.split(sql))
+
 
 class Oracle:
     """
@@ -41,7 +72,7 @@ class Oracle:
 
     """
 
-    def __init__(self, *conn_params, encoding='utf8'):
+    def __init__(self, *conn_params, encoding='utf8', arraysize=1000):
         """
         Initialize the database connection and other relevant data.
 
@@ -53,6 +84,9 @@ class Oracle:
                     port(string): tcp port where the database is listening.
                     service_name(string): Oracle instance name.
                 encoding (string): Charset encoding.
+                arraysize (int): number of rows fetched from the database
+                    in each round-trip by cx_Oracle cursors. Defaults to
+                    1000 (cx_Oracle default is 50).
 
         """
         # connection string in sqlalchemy format
@@ -62,9 +96,20 @@ class Oracle:
         self.engine = create_engine(self.conn_string,
                                     encoding=encoding,
                                     coerce_to_unicode=True,
-                                    coerce_to_decimal=False)
+                                    coerce_to_decimal=False,
+                                    arraysize=arraysize,
+                                    pool_size=10,
+                                    max_overflow=20,
+                                    pool_pre_ping=True,
+                                    pool_recycle=1800,
+                                    # reuse compiled forms of the cached
+                                    # text() clauses of execute()
+                                    execution_options={
+                                        'compiled_cache': LRUCache(
+                                            STATEMENT_CACHE_SIZE)})
         self.schema = conn_params[0]
         self.encoding = encoding
+        self._tables = {}  # reflected tables by (schema, table name)
 
     def get_table(self, table_name, schema=None):
         """
@@ -81,10 +126,7 @@ class Oracle:
         """
         if not schema:
             schema = self.schema
-
-        meta = MetaData(bind=self.engine, schema=schema)
-        return Table(table_name, meta, autoload=True,
-                     autoload_with=self.engine)
+        return reflect_table(self._tables, self.engine, table_name, schema)
 
     def execute(self, sql, **kwargs):
         """
@@ -99,18 +141,19 @@ class Oracle:
 
         """
         results = []
-        statements = sqlparse.split(sql)
+        statements = _prepare(sql)
         connection = self.engine.connect()
         # begin transaction
         trans = connection.begin()
         try:
-            for statement in statements:
+            for statement, is_ddl in statements:
+                if is_ddl:
+                    # DDL may change the definition of cached tables
+                    self._tables.clear()
                 result_set = pd.DataFrame()
-                result = connection.execute(
-                    text(statement.strip(';')), **kwargs)
+                result = connection.execute(statement, **kwargs)
                 if result.returns_rows:
-                    result_set = pd.DataFrame(result.fetchall())
-                    result_set.columns = result.keys()
+                    result_set = fetch_frame(result)
                     LOGGER.info('Number of returned rows: %s',
                                 str(len(result_set.index)))
                 results.append(result_set)
@@ -140,11 +183,79 @@ class Oracle:
 
         db_table = self.get_table(table_name, schema=schema)
         db_table.drop(self.engine, checkfirst=True)
+        self._tables.pop((schema, table_name), None)
         LOGGER.info('Table %s.%s successfully dropped.', schema, table_name)
 
         # Placeholders can only represent VALUES. You cannot use them for
         # sql keywords/identifiers.
 
+    def insert_many(self, data_table, columns=['*'], schema=None,
+                    batch_size=10000):
+        """
+        Insert a dataframe into a table via cx_Oracle array DML.
+
+        Rows are sent in batches with a single executemany call per batch,
+        which cx_Oracle binds as arrays in one round-trip. Suitable for
+        small and medium loads that do not need SQL Loader.
+        Destination table must exist in the database.
+
+            Args:
+                data_table(Dataframe): dataframe with the data to load. Must
+                    contain the target table name in its 'name' attribute.
+                columns (list): list of str containing the column names to
+                    load to a table, matched to the table columns ignoring
+                    case. Defaults to ['*'] (all columns).
+                schema (str): database schema. Defaults to connection 'user'.
+                batch_size (int): number of rows sent in each round-trip.
+                    Defaults to 10000.
+            Returns:
+                db_table(Table): sqlalchemy table mapping the table with the
+                    inserted records.
+
+        """
+        if columns == ['*']:
+            columns = list(data_table.columns)
+        if not schema:
+            schema = self.schema
+
+        db_table = self.get_table(data_table.name, schema=schema)
+        # Oracle names are case insensitive, but reflection lowercases
+        # them, so dataframe columns are matched ignoring case
+        keys = {column.name.lower(): column.key for column in db_table.c}
+        missing = [column for column in columns
+                   if str(column).lower() not in keys]
+        if missing:
+            raise ValueError(
+                f"""Columns {missing} not found in table """
+                f"""{schema}.{data_table.name}.""")
+        # object dtype turns NumPy scalars into Python values and allows
+        # missing values to be bound as NULL
+        values = data_table[columns].astype(object)
+        values = values.where(pd.notnull(values), None)
+        values.columns = [keys[str(column).lower()] for column in columns]
+
+        statement = db_table.insert()
+        row_count = 0
+        connection = self.engine.connect()
+        # begin transaction
+        trans = connection.begin()
+        try:
+            for start in range(0, len(values.index), batch_size):
+                result = connection.execute(
+                    statement,
+                    values.iloc[start:start + batch_size].to_dict('records'))
+                row_count += result.rowcount
+            # end transaction
+            trans.commit()
+        except DatabaseError as db_error:
+            trans.rollback()
+            LOGGER.error(db_error)
+            raise
+        finally:
+            connection.close()
+        LOGGER.info('Number of inserted rows: %s', str(row_count))
+        return db_table
+
     @staticmethod
     def insert(
             *conn_params,
@@ -156,7 +267,8 @@ class Oracle:
             columns=['*'],
             schema=None,
             errors='0',
-            remove_data=True):
+            remove_data=True,
+            parallel=1):
         """
         Insert a dataframe into a table via Oracle SQL Loader.
 
@@ -198,68 +310,147 @@ class Oracle:
                 allowed).
             remove_data (bool): to remove or not the log and data files
                 generated. Defaults to True.
+            parallel (int): number of SQL Loader processes. If greater than
+                1, the dataframe is split into as many partitions, each one
+                loaded by its own direct path load (DIRECT=TRUE,
+                PARALLEL=TRUE). Only allowed in APPEND mode. Defaults to 1.
 
         """
         if columns == ['*']:
-            columns = ', '.join(data_table.columns)
-        else:
-            columns = ', '.join(columns)
+            columns = list(data_table.columns)
+        field_list = ', '.join(columns)
 
         if not schema:
             schema = conn_params[0]
 
-        # control file
-        ctl_file = open(f"""{output_path}{data_table.name}.ctl""",
-                        mode='w',
-                        encoding='utf8')
-        ctl_header = f"""LOAD DATA
-                     CHARACTERSET UTF8
-                     INFILE '{output_path}{data_table.name}.dat'
-                     {mode}
-                     INTO TABLE {schema}.{data_table.name}
-                     FIELDS TERMINATED BY ';' OPTIONALLY ENCLOSED BY '\"'
-                     TRAILING NULLCOLS
-                     ({columns})"""
-
-        ctl_file.write(ctl_header)
-        ctl_file.close()
-
-        # data file
-        data_table.to_csv(
-            f"""{output_path}{data_table.name}.dat""",
-            columns=data_table.columns,
-            sep=';',
-            header=False,
-            index=False,
-            doublequote=True,
-            quoting=csv.QUOTE_NONNUMERIC,
-            encoding='utf8')
+        if parallel > 1:
+            # parallel direct path loads can only append rows
+            if mode != 'APPEND':
+                raise ValueError("Parallel loads require 'APPEND' mode.")
+            options = 'OPTIONS (DIRECT=TRUE, PARALLEL=TRUE)'
+            # contiguous row slices, the first ones one row longer when
+            # the rows do not split evenly
+            size, extra = divmod(len(data_table.index), parallel)
+            bounds = [part * size + min(part, extra)
+                      for part in range(parallel + 1)]
+            partitions = [
+                (f"""{data_table.name}_{part}""",
+                 data_table.iloc[bounds[part]:bounds[part + 1]])
+                for part in range(parallel)]
+        else:
+            options = ''
+            partitions = [(data_table.name, data_table)]
 
         # set environment variables
         env = os.environ.copy()
         env['PATH'] = os_path
         env['LD_LIBRARY_PATH'] = os_ld_library_path
 
-        # generate SQL Loader arguments
-        os_command = f"""sqlldr {conn_params[0]}/{conn_params[1]}""" + \
-            f"""@{conn_params[2]}:{conn_params[3]}/{conn_params[4]} """ + \
-            f"""control='{output_path}{data_table.name}.ctl' """ + \
-            f"""log='{output_path}{data_table.name}.log' """ + \
-            f"""bad='{output_path}{data_table.name}.bad' """ + \
-            f"""errors={errors}"""
-        args = shlex.split(os_command)
-
-        # execution of Oracle SQL Loader
+        processes = []
         try:
-            subprocess.call(args, env=env)
+            for file_name, partition in partitions:
+                # control file
+                ctl_file = open(f"""{output_path}{file_name}.ctl""",
+                                mode='w',
+                                encoding='utf8')
+                ctl_header = f"""{options}
+                             LOAD DATA
+                             CHARACTERSET UTF8
+                             INFILE '{output_path}{file_name}.dat'
+                             {mode}
+                             INTO TABLE {schema}.{data_table.name}
+                             FIELDS TERMINATED BY ';'
+                             OPTIONALLY ENCLOSED BY '\"'
+                             TRAILING NULLCOLS
+                             ({field_list})"""
+
+                ctl_file.write(ctl_header)
+                ctl_file.close()
+
+                # data file
+                Oracle._write_data_file(partition,
+                                        f"""{output_path}{file_name}.dat""",
+                                        columns)
+
+                # generate SQL Loader arguments
+                args = ['sqlldr',
+                        f"""{conn_params[0]}/{conn_params[1]}"""
+                        f"""@{conn_params[2]}:{conn_params[3]}/"""
+                        f"""{conn_params[4]}""",
+                        f"""control={output_path}{file_name}.ctl""",
+                        f"""log={output_path}{file_name}.log""",
+                        f"""bad={output_path}{file_name}.bad""",
+                        f"""errors={errors}"""]
+
+                # execution of Oracle SQL Loader: the partition is loaded
+                # while the data file of the next one is being written
+                processes.append(subprocess.Popen(args, env=env))
         except subprocess.SubprocessError as sproc_error:
             LOGGER.error(sproc_error)
+        finally:
+            for process in processes:
+                process.wait()
 
         # deleting output files
         if remove_data:
+            for file_name, _ in partitions:
+                try:
+                    os.remove(f"""{output_path}{file_name}.dat""")
+                    os.remove(f"""{output_path}{file_name}.log""")
+                    os.remove(f"""{output_path}{file_name}.bad""")
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _write_data_file(data_table, data_file, columns):
+        """
+        Write a dataframe to a SQL Loader data file.
+
+        Fields are separated by semicolons and strings are enclosed in
+        double quotes. Uses the pyarrow CSV writer if it is installed and
+        every column holds numbers or strings, as it is much faster than
+        pandas.to_csv on large dataframes. Only the
+        loaded columns are converted, without building a subset dataframe.
+
+        Args:
+            data_table(Dataframe): dataframe with the data to write.
+            data_file (str): path of the data file.
+            columns (list): list of str containing the column names to
+                write, in the order of the control file fields.
+
+        """
+        if pyarrow is not None:
             try:
-                os.remove(f"""{output_path}{data_table.name}.dat""")
-                os.remove(f"""{output_path}{data_table.name}.log""")
-                os.remove(f"""{output_path}{data_table.name}.bad""")
-            except FileNotFoundError:
-                pass
+                arrow_table = pyarrow.Table.from_pandas(data_table,
+                                                        columns=columns,
+                                                        preserve_index=False)
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                # columns with mixed types cannot be converted to Arrow
+                arrow_table = None
+            # Arrow formats dates, booleans, etc. differently from pandas
+            # (e.g. 'true', fractional seconds), which breaks loads relying
+            # on NLS formats, so it is only used for numbers and strings
+            if arrow_table is not None and all(
+                    pyarrow.types.is_integer(field.type) or
+                    pyarrow.types.is_floating(field.type) or
+                    pyarrow.types.is_string(field.type) or
+                    pyarrow.types.is_large_string(field.type) or
+                    pyarrow.types.is_null(field.type)
+                    for field in arrow_table.schema):
+                pyarrow_csv.write_csv(
+                    arrow_table,
+                    data_file,
+                    write_options=pyarrow_csv.WriteOptions(
+                        include_header=False,
+                        delimiter=';',
+                        quoting_style='needed'))
+                return
+        data_table.to_csv(
+            data_file,
+            columns=columns,
+            sep=';',
+            header=False,
+            index=False,
+            doublequote=True,
+            quoting=csv.QUOTE_NONNUMERIC,
+            encoding='utf8')
@@ -3,7 +3,11 @@
 """Integration tests for MySQL database module."""
 
 import os
+import re
+import threading
 import unittest
+from types import SimpleNamespace
+from unittest import mock
 import pandas as pd
 
 from etlstat.database.mysql import MySQL
@@ -13,10 +17,41 @@ from pyaxis import pyaxis
 
 from sqlalchemy import (Boolean, Column, DateTime, Float, Integer, String,
                         func, select)
-from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.exc import DatabaseError, InvalidRequestError
 from sqlalchemy.ext.declarative import declarative_base
 
 
+Base = declarative_base()
+
+
+# IMPORTANT: table logic reuse pattern with mixins
+class PmhMixin(object):
+    """Auxiliary sqlalchemy table model for the tests."""
+
+    id = Column(Integer, primary_key=True)
+    anno = Column(Integer)
+    cpro = Column(Integer)
+    cmun = Column(Integer)
+    csexo = Column(Integer)
+    sexo = Column(String(20))
+    orden_gredad = Column(Integer)
+    gredad = Column(String(30))
+    personas = Column(Integer)
+    codigo_ine = Column(String(50))
+
+
+class Pmh(Base, PmhMixin):
+    """Auxiliary sqlalchemy table model for the tests."""
+
+    __tablename__ = 'pmh'
+
+
+class PmhTmp(Base, PmhMixin):
+    """Auxiliary sqlalchemy table model for the tests."""
+
+    __tablename__ = 'tmp_pmh'
+
+
 class TestMySQL(unittest.TestCase):
     """Testing methods for MySQL class."""
 
@@ -73,6 +108,28 @@ class TestMySQL(unittest.TestCase):
             select([inf_schema.c.table_name]).select_from(inf_schema))
         self.assertGreaterEqual(row_count, 100)
 
+    def test_get_table_cached(self):
+        """Check that tables are reflected once until DDL is executed."""
+        my_conn = MySQL(*self.conn_params)
+        inf_schema = my_conn.get_table('inf_schema')
+        self.assertIs(my_conn.get_table('inf_schema'), inf_schema)
+        my_conn.execute('CREATE TABLE table1 (id integer)')
+        self.assertIsNot(my_conn.get_table('inf_schema'), inf_schema)
+        my_conn.drop('table1')
+
+    def test_get_table_replaced(self):
+        """Check that replacing a table refreshes its reflected columns."""
+        my_conn = MySQL(*self.conn_params)
+        data = pd.DataFrame([[1, 'a']], columns=['id', 'column1'])
+        data.name = 'table1'
+        table = my_conn.insert(data, method='multi')
+        self.assertEqual(list(table.c.keys()), ['id', 'column1'])
+        data = pd.DataFrame([[1, 2.5]], columns=['id', 'column2'])
+        data.name = 'table1'
+        table = my_conn.insert(data, if_exists='replace', method='multi')
+        self.assertEqual(list(table.c.keys()), ['id', 'column2'])
+        my_conn.drop('table1')
+
     def test_execute(self):
         """Check execute method launching arbitrary sql queries."""
         my_conn = MySQL(*self.conn_params)
@@ -172,70 +229,26 @@ class TestMySQL(unittest.TestCase):
     def test_insert(self):
         """Check that insert method inserts rows into a table."""
         my_conn = MySQL(*self.conn_params)
-        Base = declarative_base()
         current_dir = os.path.dirname(os.path.abspath(__file__))
-
-        class Pmh(Base):
-            """Auxiliary sqlalchemy table model for the tests."""
-
-            __tablename__ = 'pmh'
-
-            id = Column(Integer, primary_key=True)
-            anno = Column(Integer)
-            cpro = Column(Integer)
-            cmun = Column(Integer)
-            csexo = Column(Integer)
-            sexo = Column(String(20))
-            orden_gredad = Column(Integer)
-            gredad = Column(String(30))
-            personas = Column(Integer)
-            codigo_ine = Column(String(50))
-
-        Pmh.__table__.create(bind=my_conn.engine)
         data = pd.read_csv(f'''{current_dir}/pmh.csv''')
         data.name = 'pmh'
-        my_conn.insert(data, if_exists='append')
-        # my_conn.execute(f'''alter table {data.name} add primary key(id)''')
-        actual = my_conn.engine.scalar(
-            select([func.count('*')]).select_from(Pmh)
-        )
-        expected = len(data.index)
-        self.assertEqual(actual, expected)
-        my_conn.drop('pmh')
+        for method in ('load', 'multi'):
+            with self.subTest(method=method):
+                Pmh.__table__.create(bind=my_conn.engine)
+                my_conn.insert(data, if_exists='append', method=method,
+                               chunksize=1000)
+                actual = my_conn.engine.scalar(
+                    select([func.count('*')]).select_from(Pmh)
+                )
+                expected = len(data.index)
+                self.assertEqual(actual, expected)
+                my_conn.drop('pmh')
 
     def test_upsert(self):
         """Check that upsert method inserts or updates rows in a table."""
         my_conn = MySQL(*self.conn_params)
-        Base = declarative_base()
         current_dir = os.path.dirname(os.path.abspath(__file__))
 
-        # IMPORTANT: table logic reuse pattern with mixins
-        class PmhMixin(object):
-            """Auxiliary sqlalchemy table model for the tests."""
-
-            __tablename__ = 'pmh'
-
-            id = Column(Integer, primary_key=True)
-            anno = Column(Integer)
-            cpro = Column(Integer)
-            cmun = Column(Integer)
-            csexo = Column(Integer)
-            sexo = Column(String(20))
-            orden_gredad = Column(Integer)
-            gredad = Column(String(30))
-            personas = Column(Integer)
-            codigo_ine = Column(String(50))
-
-        class Pmh(Base, PmhMixin):
-            """Auxiliary sqlalchemy table model for the tests."""
-
-            __tablename__ = 'pmh'
-
-        class PmhTmp(Base, PmhMixin):
-            """Auxiliary sqlalchemy table model for the tests."""
-
-            __tablename__ = 'tmp_pmh'
-
         # table to update/insert
         Pmh.__table__.create(bind=my_conn.engine)
         data = pd.read_csv(f'''{current_dir}/pmh.csv''')
@@ -282,6 +295,41 @@ class TestMySQL(unittest.TestCase):
             updated_table['id'] == 30001]['cmun'].tolist()[0]
         my_conn.drop(data.name)
 
+    def test_upsert_generated_sql(self):
+        """Check upsert without query updates rows by primary key."""
+        my_conn = MySQL(*self.conn_params)
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+
+        Pmh.__table__.create(bind=my_conn.engine)
+        data = pd.read_csv(f'''{current_dir}/pmh.csv''')
+        data.name = 'pmh'
+        my_conn.insert(data, if_exists='append')
+        original_table = pd.DataFrame(
+            pd.read_sql_table(data.name, my_conn.conn_string))
+        expected = 76
+        current = original_table.loc[
+            original_table['id'] == 5192]['personas'].tolist()[0]
+        self.assertEqual(current, expected)
+        self.assertFalse((original_table['id'] == 30001).any())
+
+        PmhTmp.__table__.create(bind=my_conn.engine)
+        tmp_data = pd.read_csv(f'''{current_dir}/pmh_update.csv''')
+        tmp_data.name = 'tmp_pmh'
+        my_conn.upsert(tmp_data, data.name, if_exists='append')
+        updated_table = pd.DataFrame(
+            pd.read_sql_table(data.name, my_conn.conn_string))
+        # existing row updated
+        expected = 9976
+        current = updated_table.loc[
+            updated_table['id'] == 5192]['personas'].tolist()[0]
+        self.assertEqual(current, expected)
+        # new row inserted
+        expected = 9913
+        current = updated_table.loc[
+            updated_table['id'] == 30001]['personas'].tolist()[0]
+        self.assertEqual(current, expected)
+        my_conn.drop(data.name)
+
     def test_delete(self):
         """Check delete rows from table."""
         data_columns = ['id', 'column_string', 'column_float']
@@ -380,5 +428,121 @@ class TestMySQL(unittest.TestCase):
         my_conn.drop('ipc')
 
 
+class TestExecute(unittest.TestCase):
+    """Testing statement execution without a database."""
+
+    def setUp(self):
+        """Create a connection object on a mock engine."""
+        with mock.patch('etlstat.database.mysql.create_engine'):
+            self.my_conn = MySQL('test', 'password', '127.0.0.1', '3306',
+                                 'test')
+        self.connection = self.my_conn.engine.connect.return_value
+        self.connection.execute.return_value.returns_rows = False
+
+    def test_execute_large_statements(self):
+        """Check statements beyond the sqlparse grouping limit run."""
+        ids = ', '.join(str(i) for i in range(6000))
+        rows = ', '.join(f"({i}, 'x')" for i in range(5000))
+        sql = f"""SELECT * FROM t WHERE id IN ({ids});
+                  INSERT INTO t VALUES {rows};"""
+        results = self.my_conn.execute(sql)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.connection.execute.call_count, 2)
+        statement = self.connection.execute.call_args_list[1][0][0]
+        self.assertEqual(str(statement), f"INSERT INTO t VALUES {rows}")
+
+    def test_execute_clears_tables(self):
+        """Check reflected tables are only dropped when DDL is run."""
+        self.my_conn._tables[('test', 't')] = 'table'
+        self.my_conn.execute('SELECT * FROM t; UPDATE t SET a = 1')
+        self.assertIn(('test', 't'), self.my_conn._tables)
+        self.my_conn.execute('ALTER TABLE t ADD b INTEGER')
+        self.assertEqual(self.my_conn._tables, {})
+
+
+class StubConnection:
+    """Stand-in for a sqlalchemy connection running LOAD DATA."""
+
+    def __init__(self, read_file=True):
+        """Set whether statements read the infile before failing."""
+        self.read_file = read_file
+        self.committed = False
+        self.rolled_back = False
+
+    def begin(self):
+        """Begin a transaction."""
+        return self
+
+    def commit(self):
+        """Commit the transaction."""
+        self.committed = True
+
+    def rollback(self):
+        """Roll back the transaction."""
+        self.rolled_back = True
+
+    def execute(self, sql):
+        """Read the infile like the server does, or fail right away."""
+        if not self.read_file:
+            raise DatabaseError(sql, None, Exception('LOAD DATA refused'))
+        infile = re.search(r"INFILE '([^']+)'", sql).group(1)
+        with open(infile) as csv_file:
+            return SimpleNamespace(rowcount=len(csv_file.readlines()))
+
+
+class TestLoadData(unittest.TestCase):
+    """Testing LOAD DATA streaming without a database."""
+
+    def load(self, data, connection):
+        """Run MySQL._load_data in a thread, failing if it hangs."""
+        errors = []
+
+        def target():
+            try:
+                MySQL._load_data(data, 'test.data', 'a, b', connection)
+            except Exception as exception:  # checked by the test
+                errors.append(exception)
+
+        loader = threading.Thread(target=target, daemon=True)
+        loader.start()
+        loader.join(10)
+        self.assertFalse(loader.is_alive())
+        return errors
+
+    def test_load_data(self):
+        """Check rows streamed through the pipe are loaded and committed."""
+        data = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', None]})
+        data.name = 'data'
+        connection = StubConnection()
+        self.assertEqual(self.load(data, connection), [])
+        self.assertTrue(connection.committed)
+
+    def test_load_data_failed_statement(self):
+        """Check a statement failing before reading the pipe returns."""
+        data = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+        data.name = 'data'
+        for _ in range(5):
+            connection = StubConnection(read_file=False)
+            errors = self.load(data, connection)
+            self.assertIsInstance(errors[0], DatabaseError)
+            self.assertTrue(connection.rolled_back)
+
+    def test_load_data_failed_conversion(self):
+        """Check a load is rolled back when the CSV conversion fails."""
+        class Unprintable:
+            """Value which cannot be converted to text."""
+
+            def __str__(self):
+                raise ValueError('unprintable')
+
+        data = pd.DataFrame({'a': [1, 2], 'b': ['x', Unprintable()]})
+        data.name = 'data'
+        connection = StubConnection()
+        errors = self.load(data, connection)
+        self.assertIsInstance(errors[0], ValueError)
+        self.assertTrue(connection.rolled_back)
+        self.assertFalse(connection.committed)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,9 +2,13 @@
 
 """Integration tests for oracle database module."""
 
+import csv
 import os
+import tempfile
 import unittest
+from unittest import mock
 
+from etlstat.database import oracle
 from etlstat.database.oracle import Oracle
 
 import pandas
@@ -130,6 +134,20 @@ class TestOracle(unittest.TestCase):
             select([hlp.c.info]).select_from(hlp))
         self.assertEqual(row_count, 919)
 
+    def test_get_table_cached(self):
+        """Check that tables are reflected once until DDL is executed."""
+        ora_conn = Oracle(*self.conn_params)
+        hlp = ora_conn.get_table('help', schema='system')
+        self.assertIs(ora_conn.get_table('help', schema='system'), hlp)
+        ora_conn.execute('CREATE TABLE table1 (id INTEGER)')
+        self.assertIsNot(ora_conn.get_table('help', schema='system'), hlp)
+        table1 = ora_conn.get_table('table1')
+        ora_conn.drop('table1')
+        ora_conn.execute('CREATE TABLE table1 (id INTEGER, name VARCHAR(10))')
+        self.assertIsNot(ora_conn.get_table('table1'), table1)
+        self.assertIn('name', ora_conn.get_table('table1').c)
+        ora_conn.drop('table1')
+
     def test_create(self):
         """Check create table using sqlalchemy."""
         Base = declarative_base()
@@ -220,5 +238,241 @@ class TestOracle(unittest.TestCase):
         self.assertEqual(current, expected)
         ora_conn.drop('test_insert')
 
+    def test_insert_numbers_strings_dates(self):
+        """Check SQL Loader insert of numeric, string and date columns."""
+        ora_conn = Oracle(*self.conn_params)
+        sql = f"""CREATE TABLE test_insert_types (ranking INTEGER,
+            nickname VARCHAR(100), score NUMBER, created DATE)"""
+        ora_conn.execute(sql)
+        df = pandas.DataFrame({
+            'ranking': [10, 20, 30],
+            'nickname': ['tom', 'nick', 'juli'],
+            'score': [80.5, 15.3, 42.0],
+            'created': pandas.to_datetime(['2020-01-01 10:00:00',
+                                           '2020-01-02 11:30:00',
+                                           '2020-01-03 12:45:30'])})
+        df.name = 'test_insert_types'
+        with mock.patch.dict(os.environ,
+                             {'NLS_DATE_FORMAT': 'YYYY-MM-DD HH24:MI:SS'}):
+            ora_conn.insert(
+                *self.conn_params,
+                data_table=df,
+                output_path=self.output_path,
+                os_path='/opt/oracle/instantclient_18_3',
+                os_ld_library_path='/opt/oracle/instantclient_18_3',
+                mode='INSERT',
+                schema=self.user)
+        table = ora_conn.get_table('test_insert_types')
+        current = ora_conn.engine.scalar(
+            select([func.count('*')]).select_from(table).where(
+                table.c.nickname == 'nick').where(
+                    table.c.score == 15.3).where(
+                        func.to_char(table.c.created,
+                                     'YYYY-MM-DD HH24:MI:SS') ==
+                        '2020-01-02 11:30:00')
+        )
+        self.assertEqual(current, 1)
+        ora_conn.drop('test_insert_types')
+
+    def test_insert_many(self):
+        """Check insert rows using array DML."""
+        ora_conn = Oracle(*self.conn_params)
+        sql = f"""CREATE TABLE test_insert_many (ranking INTEGER,
+            nickname VARCHAR(100), score NUMBER)"""
+        ora_conn.execute(sql)
+        data = [[10, 'tom', 80.5], [20, 'nick', None], [30, 'juli', 15.3]]
+        df = pandas.DataFrame(data, columns=['ranking', 'nickname', 'score'])
+        df.name = 'test_insert_many'
+        table = ora_conn.insert_many(df, batch_size=2)
+        expected = 3
+        current = ora_conn.engine.scalar(
+            select([func.count('*')]).select_from(table)
+        )
+        self.assertEqual(current, expected)
+        current = ora_conn.engine.scalar(
+            select([func.count('*')]).select_from(table).where(
+                table.c.score.is_(None))
+        )
+        self.assertEqual(current, 1)
+        ora_conn.drop('test_insert_many')
+
+    def test_insert_many_uppercase(self):
+        """Check array DML insert with uppercase dataframe columns."""
+        ora_conn = Oracle(*self.conn_params)
+        sql = f"""CREATE TABLE test_insert_many (ranking INTEGER,
+            nickname VARCHAR(100), score NUMBER)"""
+        ora_conn.execute(sql)
+        data = [[10, 'tom', 80.5], [20, 'nick', 15.3]]
+        df = pandas.DataFrame(data, columns=['RANKING', 'NICKNAME', 'Score'])
+        df.name = 'test_insert_many'
+        table = ora_conn.insert_many(df)
+        current = ora_conn.engine.scalar(
+            select([func.count('*')]).select_from(table).where(
+                table.c.nickname == 'nick').where(table.c.score == 15.3)
+        )
+        self.assertEqual(current, 1)
+        df = pandas.DataFrame(data, columns=['RANKING', 'NAME', 'SCORE'])
+        df.name = 'test_insert_many'
+        with self.assertRaises(ValueError):
+            ora_conn.insert_many(df)
+        ora_conn.drop('test_insert_many')
+
+    def test_insert_parallel(self):
+        """Check insert rows using parallel SQL Loader runs."""
+        ora_conn = Oracle(*self.conn_params)
+        sql = f"""CREATE TABLE test_insert_parallel (ranking INTEGER,
+            nickname VARCHAR(100), score NUMBER)"""
+        ora_conn.execute(sql)
+        data = [[10, 'tom', 80.5], [20, 'nick', 15.3], [30, 'juli', 42.0]]
+        df = pandas.DataFrame(data, columns=['ranking', 'nickname', 'score'])
+        df.name = 'test_insert_parallel'
+        ora_conn.insert(
+            *self.conn_params,
+            data_table=df,
+            output_path=self.output_path,
+            os_path='/opt/oracle/instantclient_18_3',
+            os_ld_library_path='/opt/oracle/instantclient_18_3',
+            mode='APPEND',
+            schema=self.user,
+            parallel=2
+        )
+        table = ora_conn.get_table('test_insert_parallel')
+        expected = 3
+        current = ora_conn.engine.scalar(
+            select([func.count('*')]).select_from(table)
+        )
+        self.assertEqual(current, expected)
+        for part in range(2):
+            self.assertFalse(os.path.exists(
+                f'{self.output_path}test_insert_parallel_{part}.dat'))
+        ora_conn.drop('test_insert_parallel')
+
+
+class TestExecute(unittest.TestCase):
+    """Testing statement execution without a database."""
+
+    def setUp(self):
+        """Create a connection object on a mock engine."""
+        with mock.patch('etlstat.database.oracle.create_engine'):
+            self.ora_conn = Oracle('test', 'password', 'localhost', '1521',
+                                   'xe')
+        self.connection = self.ora_conn.engine.connect.return_value
+        self.connection.execute.return_value.returns_rows = False
+
+    def test_execute_large_statements(self):
+        """Check statements beyond the sqlparse grouping limit run."""
+        ids = ', '.join(str(i) for i in range(6000))
+        sql = f"""SELECT * FROM t WHERE id IN ({ids});
+                  DELETE FROM t WHERE id IN ({ids})"""
+        results = self.ora_conn.execute(sql)
+        self.assertEqual(len(results), 2)
+        statement = self.connection.execute.call_args_list[1][0][0]
+        self.assertEqual(str(statement), f"DELETE FROM t WHERE id IN ({ids})")
+
+    def test_prepare(self):
+        """Check statements are prepared once and flagged when DDL."""
+        sql = 'SELECT * FROM t; CREATE TABLE t2 (id INTEGER);'
+        statements = oracle._prepare(sql)
+        self.assertIs(oracle._prepare(sql), statements)
+        self.assertEqual([(str(statement), ddl)
+                          for statement, ddl in statements],
+                         [('SELECT * FROM t', False),
+                          ('CREATE TABLE t2 (id INTEGER)', True)])
+
+
+class TestParallelInsert(unittest.TestCase):
+    """Testing parallel SQL Loader files without a database."""
+
+    conn_params = ['test', 'password', 'localhost', '1521', 'xe']
+    data = pandas.DataFrame({'ranking': [10, 20, 30],
+                             'nickname': ['tom', 'nick', 'juli']})
+    data.name = 'test_parallel'
+
+    def insert(self, output_path, **kwargs):
+        """Run Oracle.insert without starting SQL Loader."""
+        with mock.patch.object(oracle.subprocess, 'Popen') as popen:
+            Oracle.insert(*self.conn_params,
+                          data_table=self.data,
+                          output_path=output_path,
+                          os_path='',
+                          os_ld_library_path='',
+                          **kwargs)
+        return popen
+
+    def test_partition_files(self):
+        """Check each partition gets its own control and data files."""
+        output_path = tempfile.mkdtemp() + '/'
+        popen = self.insert(output_path, mode='APPEND', parallel=2,
+                            remove_data=False)
+        self.assertEqual(popen.call_count, 2)
+        self.assertEqual(popen.return_value.wait.call_count, 2)
+        rows = []
+        for part in range(2):
+            file_name = f'{output_path}test_parallel_{part}'
+            with open(f'{file_name}.ctl', encoding='utf8') as ctl_file:
+                ctl = ctl_file.read()
+            self.assertIn('OPTIONS (DIRECT=TRUE, PARALLEL=TRUE)', ctl)
+            self.assertIn(f"INFILE '{file_name}.dat'", ctl)
+            self.assertIn('APPEND', ctl)
+            self.assertIn(f'control={file_name}.ctl',
+                          popen.call_args_list[part][0][0])
+            with open(f'{file_name}.dat', encoding='utf8') as dat_file:
+                rows.append(dat_file.read().splitlines())
+        self.assertEqual(rows, [['10;"tom"', '20;"nick"'], ['30;"juli"']])
+
+    def test_remove_partition_files(self):
+        """Check the data files of every partition are removed."""
+        output_path = tempfile.mkdtemp() + '/'
+        self.insert(output_path, mode='APPEND', parallel=2)
+        for part in range(2):
+            self.assertFalse(os.path.exists(
+                f'{output_path}test_parallel_{part}.dat'))
+
+    def test_parallel_requires_append(self):
+        """Check parallel loads are refused in modes other than APPEND."""
+        output_path = tempfile.mkdtemp() + '/'
+        for mode in ('INSERT', 'REPLACE', 'TRUNCATE'):
+            with self.assertRaises(ValueError):
+                self.insert(output_path, mode=mode, parallel=2)
+        self.assertEqual(os.listdir(output_path), [])
+
+
+class TestDataFile(unittest.TestCase):
+    """Testing SQL Loader data files without a database."""
+
+    data = pandas.DataFrame({
+        'ranking': [10, 20, 30],
+        'nickname': ['tom', 'a;b', 'say "hi"'],
+        'score': [80.5, 0.1 + 0.2, -1e20],
+        'created': pandas.to_datetime(['2020-01-01 10:00:00',
+                                       '2020-01-02', '2020-01-03']),
+        'active': [True, False, True]})
+
+    def assert_written_as_pandas(self, columns):
+        """Check the data file matches pandas.to_csv output."""
+        output_dir = tempfile.mkdtemp()
+        Oracle._write_data_file(self.data, f'{output_dir}/data.dat', columns)
+        self.data.to_csv(f'{output_dir}/expected.dat', columns=columns,
+                         sep=';', header=False, index=False,
+                         doublequote=True, quoting=csv.QUOTE_NONNUMERIC,
+                         encoding='utf8')
+        with open(f'{output_dir}/data.dat', encoding='utf8') as current, \
+                open(f'{output_dir}/expected.dat',
+                     encoding='utf8') as expected:
+            self.assertEqual(current.read(), expected.read())
+
+    @unittest.skipIf(oracle.pyarrow is None, 'pyarrow is not installed')
+    def test_numbers_strings(self):
+        """Check numbers and strings are written by pyarrow."""
+        with mock.patch.object(oracle.pyarrow_csv, 'write_csv',
+                               wraps=oracle.pyarrow_csv.write_csv) as writer:
+            self.assert_written_as_pandas(['ranking', 'score', 'nickname'])
+        self.assertTrue(writer.called)
+
+    def test_dates_booleans(self):
+        """Check dates and booleans keep the pandas format."""
+        self.assert_written_as_pandas(['ranking', 'created', 'active'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""Unit tests for database utils module."""
+import unittest
+from unittest import mock
+
+import etlstat.database.utils as utils
+
+
+class StubResult:
+    """Stand-in for a sqlalchemy result set."""
+
+    def __init__(self, columns, rows):
+        """Set the column names and the rows to fetch."""
+        self.columns = columns
+        self.rows = rows
+
+    def keys(self):
+        """Return the column names."""
+        return self.columns
+
+    def fetchmany(self, size):
+        """Return the next rows of the result set."""
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+
+class TestUtils(unittest.TestCase):
+    """Testing methods for database util functions."""
+
+    def test_is_ddl(self):
+        """Check statements are told apart by their first keyword."""
+        for statement in ('select 1', ' /* hint */ SELECT 1',
+                          '-- comment\nINSERT INTO t VALUES (1)',
+                          'update t set a = 1', 'DELETE FROM t',
+                          'WITH a AS (SELECT 1) SELECT * FROM a'):
+            self.assertFalse(utils.is_ddl(statement), statement)
+        for statement in ('CREATE TABLE t (a INTEGER)', 'drop table t',
+                          'ALTER TABLE t ADD b INTEGER', 'TRUNCATE TABLE t'):
+            self.assertTrue(utils.is_ddl(statement), statement)
+
+    def test_fetch_frame(self):
+        """Check all the rows of a result set are fetched."""
+        result = StubResult(['a', 'b'], [(i, str(i)) for i in range(7)])
+        with mock.patch.object(utils, 'FETCH_SIZE', 3):
+            result_set = utils.fetch_frame(result)
+        self.assertEqual(list(result_set.columns), ['a', 'b'])
+        self.assertEqual(result_set['a'].tolist(), list(range(7)))
+
+    def test_fetch_frame_types(self):
+        """Check column types do not depend on the fetched chunks."""
+        # the first chunk of 'b' is all NULL, the second one has no NULL
+        rows = [(1, None), (2, None), (3, None), (4, 10), (5, 20)]
+        with mock.patch.object(utils, 'FETCH_SIZE', 3):
+            result_set = utils.fetch_frame(StubResult(['a', 'b'], rows))
+        self.assertEqual(result_set['b'].dtype, 'float64')
+        self.assertEqual(result_set['b'].isnull().sum(), 3)
+
+    def test_fetch_frame_empty(self):
+        """Check an empty result set keeps its column names."""
+        result_set = utils.fetch_frame(StubResult(['a', 'b'], []))
+        self.assertTrue(result_set.empty)
+        self.assertEqual(list(result_set.columns), ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
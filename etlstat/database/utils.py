@@ -0,0 +1,91 @@
+# coding: utf-8
+"""
+This module contains helpers shared by the database modules.
+
+    Version:
+        0.1
+
+    Notes:
+        Reflected tables are cached by (schema, table name) in a dictionary
+        owned by each connection object, which must clear it when DDL is
+        executed.
+
+"""
+
+from sqlalchemy import MetaData, Table
+
+import pandas as pd
+
+from sqlparse import lexer, tokens
+
+DML_TYPES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+FETCH_SIZE = 50000  # rows fetched from a result set at a time
+
+
+def is_ddl(statement):
+    """
+    Tell whether a SQL statement may change the definition of tables.
+
+    Only the first keyword of the statement is looked at. The statement is
+    tokenized lazily and never grouped, since grouping is slow and sqlparse
+    refuses to group statements of more than 10000 tokens.
+
+        Args:
+            statement (string): a single SQL statement, as returned by
+                sqlparse.split().
+        Returns:
+            is_ddl (bool): False for SELECT, INSERT, UPDATE and DELETE
+                statements, including those starting with a WITH clause.
+
+    """
+    for ttype, value in lexer.tokenize(statement):
+        if ttype in tokens.Whitespace or ttype in tokens.Comment:
+            continue
+        return value.upper() not in DML_TYPES + ('WITH',)
+    return False
+
+
+def fetch_frame(result):
+    """
+    Fetch a result set into a dataframe.
+
+    Rows are fetched FETCH_SIZE at a time and the dataframe is built once
+    from all of them, so column types are inferred over the whole result
+    set and do not depend on where the chunks end.
+
+        Args:
+            result (ResultProxy): result of a row-returning statement.
+        Returns:
+            result_set (DataFrame): dataframe with the fetched rows.
+
+    """
+    rows = []
+    for chunk in iter(lambda: result.fetchmany(FETCH_SIZE), []):
+        rows.extend(chunk)
+    return pd.DataFrame(rows, columns=result.keys())
+
+
+def reflect_table(tables, engine, table_name, schema):
+    """
+    Get a database table from a cache of reflected tables.
+
+    Reflection issues several metadata queries, so each table is reflected
+    once and kept in the cache until it is dropped from it.
+
+        Args:
+            tables (dict): reflected tables by (schema, table name).
+            engine (Engine): sqlalchemy engine to reflect the table with.
+            table_name (string): name of the database table to map.
+            schema (string): name of the schema to which the table belongs.
+        Returns:
+            table(Table): sqlalchemy Table object referencing the specified
+                database table.
+
+    """
+    key = (schema, table_name)
+    if key not in tables:
+        meta = MetaData(bind=engine, schema=schema)
+        tables[key] = Table(table_name, meta, autoload=True,
+                            autoload_with=engine)
+    return tables[key]
@@ -242,10 +242,11 @@ def _px_from_urls_in_csv(filename, sep=",", csv_encoding='windows-1252',
                        sep=sep,
                        encoding=csv_encoding)
     data = {}
-    uris['data'] = uris.apply(lambda row: pyaxis.parse(
-        row['url'], px_encoding, timeout=timeout, null_values=null_values,
-        sd_values=sd_values)['DATA'], axis=1)
-    data = pd.Series(uris['data'].values, index=uris['id']).to_dict()
+    # iterate the columns directly: apply(axis=1) boxes every row in a Series
+    for uri_id, url in zip(uris['id'], uris['url']):
+        data[uri_id] = pyaxis.parse(
+            url, px_encoding, timeout=timeout, null_values=null_values,
+            sd_values=sd_values)['DATA']
     return data
 
 
@@ -319,15 +320,15 @@ def txt(dir_path, sep=';', encoding='windows-1252',
     assignation_map = match_data_format(dir_path, data_extension, format_path,
                                         format_extension)
     for txt_file in assignation_map:
-        conversion = dict()
         assignation_map[txt_file] = pd.read_csv(format_path +
                                                 assignation_map[txt_file],
                                                 sep=sep,
                                                 encoding=encoding)
-        for line in range(len(assignation_map[txt_file])):
-            conversion[assignation_map[txt_file]['FIELD_NAME'][line]
-                       ] = conversion_map[assignation_map[txt_file]
-                                          ['DATA_TYPE'][line]]
+        conversion = {
+            field_name: conversion_map[data_type]
+            for field_name, data_type in zip(
+                assignation_map[txt_file]['FIELD_NAME'],
+                assignation_map[txt_file]['DATA_TYPE'])}
         assignation_map[txt_file] = pd.read_fwf(dir_path + txt_file,
                                                 widths=assignation_map
                                                 [txt_file]['LENGTH'].tolist(),
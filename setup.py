@@ -21,10 +21,13 @@ setup(
         'defusedxml>=0.5.0',
         'pyaxis>=0.3.1',
         'numpy>=1.15.4',
-        'pandas>=0.23.4',
+        'pandas>=0.24.0',
         'python_Levenshtein>=0.12.0',
         'psycopg2'
     ],
+    extras_require={
+        'arrow': ['pyarrow>=7.0']
+    },
     test_suite='extractor.test, database.test, text.test',
     keywords=['etl', 'icane', 'statistics', 'utils'],
     classifiers=[